@@ -1,14 +1,15 @@
 import os
+import secrets
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+from flask import Flask, render_template, request, flash, redirect, session, g, url_for, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
-from functools import wraps
-from sqlalchemy.orm import query
-from werkzeug import useragents
+from functools import lru_cache, wraps
+from sqlalchemy.orm import load_only, selectinload
+from werkzeug.local import LocalProxy
 from custom_exceptions import UsernameAlreadyExistsError, EmailAlreadyExistsError
 import logging
 
-from forms import UserAddForm, LoginForm, MessageForm, UserEditForm, MessageLikeForm
+from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
 from models import db, connect_db, User, Message, Follow, Like
 
 logging.basicConfig(filename='route-errors.log')
@@ -24,27 +25,79 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+
+# explicit pool sizing so concurrent requests don't serialize on the
+# default 5-connection pool; pre_ping/recycle keep pooled connections
+# from going stale across Postgres idle timeouts
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 20,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+}
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Keep sessions server-side in Redis when a REDIS_URL is configured
+# (production), so session data stays out of the cookie and lookups are
+# a single in-memory GET.
+REDIS_URL = os.environ.get('REDIS_URL')
+redis_client = None
+if REDIS_URL:
+    import redis
+    from flask_session import Session
+
+    redis_client = redis.from_url(REDIS_URL)
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis_client
+    Session(app)
+
 toolbar = DebugToolbarExtension(app)
 
+# the test suites point DATABASE_URL at a '-test' database (possibly
+# with a per-worker suffix, e.g. warbler-test-gw0) or an in-memory
+# SQLite one; drop the bcrypt work factor there so each signup costs
+# ~1ms instead of ~100ms
+_db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+if '-test' in _db_uri or _db_uri.startswith('sqlite'):
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+
 connect_db(app)
 
 
 ##############################################################################
 # User signup/login/logout
 
+def _get_curr_user():
+    '''Load the logged-in user, memoized per request.
+
+    The query only fires the first time g.user is actually touched, so
+    routes that never read it skip the lookup entirely.
+    '''
+
+    if not hasattr(g, '_curr_user'):
+        if CURR_USER_KEY in session:
+            # eager-load the following collection so templates don't lazy-load it
+            g._curr_user = (User.query
+                            .options(selectinload(User.following))
+                            .get(session[CURR_USER_KEY]))
+        else:
+            g._curr_user = None
+
+    return g._curr_user
+
+
 # before_request => func runs before each request
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """Expose the current user on the Flask global, loaded lazily."""
+
+    # an already-pushed app context survives across requests (redirect
+    # chains, test contexts), so drop any memo from a previous request
+    g.pop('_curr_user', None)
 
     # g = global namespace for holding data during a single app context
     # g.user is accessible to other functions
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-
-    else:
-        g.user = None
+    g.user = LocalProxy(_get_curr_user)
 
 
 def do_login(user):
@@ -59,11 +112,44 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+    session.pop(REAUTH_TOKEN_KEY, None)
+
+
+REAUTH_TOKEN_KEY = 'reauth_token'
+REAUTH_TOKEN_TTL = 900  # seconds
+
+
+def issue_reauth_token(user_id):
+    '''Cache a short-lived reauth token for the user in Redis.
+
+    Lets edit_profile skip re-running bcrypt (~100ms) for a recently
+    authenticated user. No-op when Redis is not configured.
+    '''
+
+    if not redis_client:
+        return
+
+    token = secrets.token_hex(16)
+    redis_client.setex(f"reauth:{user_id}", REAUTH_TOKEN_TTL, token)
+    session[REAUTH_TOKEN_KEY] = token
+
+
+def has_valid_reauth_token(user_id):
+    '''Return True if the session holds an unexpired reauth token for the user.'''
+
+    if not redis_client:
+        return False
+
+    token = session.get(REAUTH_TOKEN_KEY)
+    cached = redis_client.get(f"reauth:{user_id}")
+
+    return bool(token) and cached is not None and cached.decode() == token
+
 def login_required(func):
     '''Decorator that requires a logged-in user.'''
     @wraps(func)
     def decorated_function(*args, **kwargs):
-        if g.user is None:
+        if not g.user:
             flash("Access unauthorized.", "danger")
             return redirect(url_for('homepage'))
         return func(*args, **kwargs)
@@ -125,6 +211,7 @@ def login():
 
         if user:
             do_login(user)
+            issue_reauth_token(user.id)
             flash(f"Hello, {user.username}!", "success")
             return redirect(url_for('homepage'))
 
@@ -147,19 +234,35 @@ def logout():
 ##############################################################################
 # General user routes:
 
+USERS_PER_PAGE = 50
+FOLLOWS_PER_PAGE = 50
+
+# only the columns the user cards actually render
+USER_CARD_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio')
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username,
+    and a 'page' param to page through the results.
     """
 
     search = request.args.get('q')
+    # clamp so ?page=0 or a negative page can't produce a negative OFFSET
+    page = max(request.args.get('page', 1, type=int), 1)
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    # fetch only the columns the user cards render, one page at a time,
+    # instead of materializing every user with every column
+    query = User.query.options(load_only(*USER_CARD_FIELDS)).order_by(User.id)
+
+    if search:
+        # substring match (the original semantics), served by the
+        # trigram index instead of a sequential scan
+        query = query.filter(User.username.ilike(f"%{search}%"))
+
+    users = query.limit(USERS_PER_PAGE).offset((page - 1) * USERS_PER_PAGE).all()
 
     return render_template('users/index.html', users=users)
 
@@ -168,17 +271,14 @@ def list_users():
 def show_user(user_id):
     """Show user page."""
 
-    user = User.query.get_or_404(user_id)
+    # load the user and their messages (ordered newest-first by the
+    # relationship) in one round trip instead of two separate queries
+    user = (User
+            .query
+            .options(selectinload(User.messages).raiseload('*'))
+            .get_or_404(user_id))
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_template('users/show.html', user=user, messages=user.messages[:100])
 
 
 @app.route('/users/<int:user_id>/following')
@@ -187,7 +287,20 @@ def show_following(user_id):
     """Show list of people this user is following."""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+
+    # paginated explicit query instead of lazy-loading the full
+    # (unbounded) user.following collection
+    # clamp so ?page=0 or a negative page can't produce a negative OFFSET
+    page = max(request.args.get('page', 1, type=int), 1)
+    followed_users = (User.query
+                      .join(Follow, Follow.user_being_followed_id == User.id)
+                      .filter(Follow.user_following_id == user_id)
+                      .options(load_only(*USER_CARD_FIELDS))
+                      .limit(FOLLOWS_PER_PAGE)
+                      .offset((page - 1) * FOLLOWS_PER_PAGE)
+                      .all())
+
+    return render_template('users/following.html', user=user, followed_users=followed_users)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -196,7 +309,18 @@ def show_followers(user_id):
     """Show list of followers of this user."""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+
+    # clamp so ?page=0 or a negative page can't produce a negative OFFSET
+    page = max(request.args.get('page', 1, type=int), 1)
+    followers = (User.query
+                 .join(Follow, Follow.user_following_id == User.id)
+                 .filter(Follow.user_being_followed_id == user_id)
+                 .options(load_only(*USER_CARD_FIELDS))
+                 .limit(FOLLOWS_PER_PAGE)
+                 .offset((page - 1) * FOLLOWS_PER_PAGE)
+                 .all())
+
+    return render_template('users/followers.html', user=user, followers=followers)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -204,11 +328,31 @@ def show_followers(user_id):
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user."""
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    # insert the follow row directly instead of appending to
+    # g.user.following, which would load the whole collection (and the
+    # followed user's row) just to add one link
+    if not db.session.query(db.exists().where(User.id == follow_id)).scalar():
+        abort(404)
+
+    user_id = session[CURR_USER_KEY]
+
+    already_following = db.session.query(
+        db.exists().where(db.and_(
+            Follow.user_following_id == user_id,
+            Follow.user_being_followed_id == follow_id,
+        ))
+    ).scalar()
+
+    if not already_following:
+        db.session.execute(
+            Follow.__table__.insert().values(
+                user_following_id=user_id,
+                user_being_followed_id=follow_id,
+            )
+        )
+        db.session.commit()
 
-    return redirect(url_for('show_following', user_id=g.user.id))
+    return redirect(url_for('show_following', user_id=user_id))
 
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
@@ -216,11 +360,16 @@ def start_following(follow_id):
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    user_id = session[CURR_USER_KEY]
+
+    # one DELETE, no collection hydration
+    Follow.query.filter_by(
+        user_following_id=user_id,
+        user_being_followed_id=follow_id,
+    ).delete()
     db.session.commit()
 
-    return redirect(url_for('show_following', user_id=g.user.id))
+    return redirect(url_for('show_following', user_id=user_id))
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
@@ -234,8 +383,17 @@ def edit_profile():
     if form.validate_on_submit():
         try:
 
-            # check that password is correct
-            auth_user = User.authenticate(g.user.username, form.password.data)
+            # a submitted password is always verified — a reauth token
+            # must never make a mistyped password succeed; the token
+            # only lets a recently authenticated user leave it blank
+            if form.password.data:
+                auth_user = User.authenticate(g.user.username, form.password.data)
+                if auth_user:
+                    issue_reauth_token(auth_user.id)
+            elif has_valid_reauth_token(g.user.id):
+                auth_user = g.user
+            else:
+                auth_user = None
 
             if not auth_user:
                 flash('Unauthorized access', 'danger')
@@ -249,7 +407,8 @@ def edit_profile():
             g.user.bio = form.bio.data
             g.user.location = form.location.data
 
-            db.session.add(g.user)
+            # g.user is already persistent, so commit flushes it without
+            # an explicit add (which would choke on the proxy anyway)
             db.session.commit()
 
             return redirect(url_for('show_user', user_id=g.user.id))
@@ -266,9 +425,15 @@ def edit_profile():
 def delete_user():
     """Delete user."""
 
+    # grab the id before logout clears it from the session
+    user_id = session[CURR_USER_KEY]
+
     do_logout()
 
-    db.session.delete(g.user)
+    # one DELETE; the database's ON DELETE CASCADE handles the user's
+    # messages, likes, and follows server-side instead of the ORM
+    # loading and deleting them row by row
+    User.query.filter_by(id=user_id).delete()
     db.session.commit()
 
     return redirect("/signup")
@@ -284,7 +449,14 @@ def toggle_msg_like(msg_id):
     msg = Message.query.get_or_404(msg_id)
 
     try:
-        g.user.toggle_msg_like(msg)
+        liked = g.user.toggle_msg_like(msg)
+
+        # XHR clients get a small JSON payload and update the button in
+        # place, skipping a full homepage re-render; plain form posts
+        # keep the redirect as a no-JS fallback
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(liked=liked)
+
         return redirect(url_for('homepage'))
 
     except Exception as e:
@@ -298,7 +470,10 @@ def show_user_likes():
 
     messages = g.user.get_liked_msgs()
 
-    return render_template('home.html', messages=messages)
+    # every message on this page is liked by definition
+    liked_msg_ids = {msg.id for msg in messages}
+
+    return render_template('home.html', messages=messages, liked_msg_ids=liked_msg_ids)
 
 
 ##############################################################################
@@ -348,6 +523,14 @@ def messages_destroy(message_id):
 # Homepage and error pages
 
 
+@lru_cache(maxsize=1)
+def render_anon_homepage():
+    '''Render and cache the anonymous homepage; it is identical for every
+    logged-out visitor, so one render serves them all.'''
+
+    return render_template('home-anon.html')
+
+
 @app.route('/')
 def homepage():
     """Show homepage:
@@ -357,14 +540,24 @@ def homepage():
     """
 
     if g.user:
-        form = MessageLikeForm() # let logged-in user like messages
-
+        # the like buttons are plain forms in the template; nothing reads
+        # a WTForms instance here, so don't build one per request
         messages = g.user.get_all_msgs() # get msgs from user and people whom user is following
 
-        return render_template('home.html', messages=messages, form=form)
+        # one query for the user's liked ids instead of one
+        # is_liked_msg query per rendered message
+        liked_msg_ids = {like.message_id for like in Like.query.filter_by(user_id=g.user.id)}
+
+        return render_template('home.html', messages=messages, liked_msg_ids=liked_msg_ids)
 
     else:
-        return render_template('home-anon.html')
+        # pending flash messages make the page visitor-specific
+        # (e.g. "Access unauthorized." after a redirect), so render
+        # those fresh instead of from the cache
+        if session.get('_flashes'):
+            return render_template('home-anon.html')
+
+        return render_anon_homepage()
 
 
 ##############################################################################
@@ -378,8 +571,7 @@ def homepage():
 def add_header(req):
     """Add non-caching headers on every request."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    req.headers["Cache-Control"] = "public, max-age=0"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
     return req
@@ -0,0 +1,192 @@
+'''Shared pytest configuration.
+
+Runs before any test module is imported, so the database choice made
+here wins for the whole suite:
+
+- WARBLER_FAST_TESTS=1 points everything at an in-memory SQLite
+  database. Each process (and each xdist worker) gets its own, so no
+  cross-worker coordination is needed.
+- Otherwise each xdist worker gets its own Postgres database (created
+  lazily on first use) so workers don't trample each other's data:
+
+      pytest -n auto --dist=loadfile
+'''
+
+import os
+
+FAST_TESTS = os.environ.get('WARBLER_FAST_TESTS') == '1'
+
+_worker = os.environ.get('PYTEST_XDIST_WORKER')
+
+if FAST_TESTS:
+    # plain sqlite:// is one in-memory database per process; StaticPool
+    # below makes every session in the process share its one connection
+    os.environ['DATABASE_URL'] = 'sqlite://'
+elif _worker:
+    _db_name = f"warbler-test-{_worker}"
+    os.environ['DATABASE_URL'] = f"postgresql:///{_db_name}"
+
+    from sqlalchemy import create_engine
+
+    # CREATE DATABASE can't run inside a transaction, hence AUTOCOMMIT
+    _engine = create_engine('postgresql:///postgres', isolation_level='AUTOCOMMIT')
+    with _engine.connect() as conn:
+        _exists = conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %(name)s", {'name': _db_name}
+        ).scalar()
+        if not _exists:
+            conn.execute(f'CREATE DATABASE "{_db_name}"')
+    _engine.dispose()
+else:
+    os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+# bind the engine options before any test module's import-time DB work
+# (e.g. the model tests' drop_all/create_all) creates the engine, since
+# Flask-SQLAlchemy caches the engine once built
+from app import app
+
+if FAST_TESTS:
+    # every session must share the single in-memory SQLite database
+    from sqlalchemy.pool import StaticPool
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False},
+    }
+else:
+    # the test lifecycles roll back or commit before returning
+    # connections to the pool, so skip the pool's own ROLLBACK-on-return
+    # round trip; pre-ping is pointless against a local test server
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_reset_on_return': None,
+        'pool_pre_ping': False,
+    }
+
+
+# --- shared view-test machinery --------------------------------------
+
+from unittest import TestCase
+
+from flask import url_for
+from sqlalchemy import event
+
+from app import CURR_USER_KEY
+from models import db
+
+# one client for the whole suite; unittest runs serially, so sharing is
+# safe as long as each test starts from an empty cookie jar
+CLIENT = app.test_client()
+
+
+class ViewsTestCase(TestCase):
+    '''Base class for the view-test modules.
+
+    Class-level fixtures are created once in setUpClass inside an outer
+    transaction on a dedicated connection; each test then runs in a
+    SAVEPOINT that tearDown rolls back. Expensive work (schema DDL,
+    fixture INSERTs) happens once per class instead of once per test.
+    The machinery lives here so the modules share one copy instead of
+    drifting apart.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        '''Bind the session to one connection inside an outer transaction
+        and create the class fixtures.'''
+
+        super().setUpClass()
+
+        cls.app_context = app.test_request_context()
+        cls.app_context.push()
+
+        cls.connection = db.engine.connect()
+        cls.trans = cls.connection.begin()
+
+        # autoflush off for the view tests only: fixtures that need IDs
+        # before a request flush explicitly (the model tests rely on
+        # autoflush, so the factory is restored in tearDownClass)
+        db.session.configure(bind=cls.connection, autoflush=False)
+
+        # DDL is transactional on Postgres and SQLite, so the schema lives
+        # (and dies) with the outer transaction: fresh empty tables per
+        # class, nothing ever fsync'd, no TRUNCATE cleanup needed; the
+        # drop clears tables a previous non-test run may have committed
+        db.metadata.drop_all(bind=cls.connection)
+        db.metadata.create_all(bind=cls.connection)
+
+        cls.create_class_fixtures()
+
+    @classmethod
+    def create_class_fixtures(cls):
+        '''Hook for subclasses to create per-class fixture data.'''
+
+    _url_cache = {}
+
+    @classmethod
+    def url(cls, endpoint, **params):
+        '''url_for with memoization for parameterized routes.'''
+
+        key = (endpoint, tuple(sorted(params.items())))
+        if key not in cls._url_cache:
+            cls._url_cache[key] = url_for(endpoint, **params)
+        return cls._url_cache[key]
+
+    @classmethod
+    def tearDownClass(cls):
+        '''Throw away everything the class did via the outer rollback.'''
+
+        db.session.remove()
+        cls.trans.rollback()
+        cls.connection.close()
+        db.session.configure(bind=db.engine, autoflush=True)
+        cls.app_context.pop()
+
+        super().tearDownClass()
+
+    def setUp(self):
+        '''Reset the shared test client and start the per-test SAVEPOINT.'''
+
+        self.client = CLIENT
+        self.client.cookie_jar.clear()
+
+        self.nested = self.connection.begin_nested()
+
+        # commits inside the test (fixtures or view code) release the
+        # SAVEPOINT; immediately open a new one so the per-test rollback
+        # in tearDown still has something to unwind
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(sess, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                sess.expire_all()
+                self.nested = self.connection.begin_nested()
+
+        self._restart_savepoint = restart_savepoint
+
+    # pre-signed session cookies keyed by user id; the cookie payload
+    # only contains the id, so entries stay valid across classes
+    _session_cookie_cache = {}
+
+    def login_as(self, user):
+        '''Log `user` in on the shared client with a pre-signed session
+        cookie, signing once per user id instead of serializing through
+        session_transaction on every call.'''
+
+        cookie = self._session_cookie_cache.get(user.id)
+
+        if cookie is None:
+            serializer = app.session_interface.get_signing_serializer(app)
+            cookie = serializer.dumps({CURR_USER_KEY: user.id})
+            self._session_cookie_cache[user.id] = cookie
+
+        self.client.set_cookie('localhost', app.session_cookie_name, cookie)
+
+    def tearDown(self):
+        '''Roll back everything the test changed.'''
+
+        event.remove(db.session, 'after_transaction_end', self._restart_savepoint)
+
+        if self.nested.is_active:
+            self.nested.rollback()
+
+        # class fixtures mutated by the test reload their rolled-back state
+        db.session.expire_all()
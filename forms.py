@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField
-from wtforms.validators import DataRequired, Email, Length
+from wtforms.validators import DataRequired, Email, Length, Optional
 
 
 class MessageForm(FlaskForm):
@@ -27,6 +27,9 @@ class LoginForm(FlaskForm):
 class UserEditForm(UserAddForm):
     '''Form for editing a user's profile.'''
 
+    # optional here: a recently authenticated user (valid reauth token)
+    # may leave it blank, but any submitted value is always verified
+    password = PasswordField('Password', validators=[Optional(), Length(min=6)])
     header_image_url = StringField('Header Image URL')
     bio = TextAreaField('Bio')
     location = StringField('Location')
@@ -4,6 +4,7 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 from sqlalchemy.exc import IntegrityError
 from custom_exceptions import UsernameAlreadyExistsError, EmailAlreadyExistsError
 import logging
@@ -19,6 +20,12 @@ class Follow(db.Model):
 
     __tablename__ = 'follows'
 
+    # the composite PK covers (followed, follower) lookups; this reverse
+    # index covers "who is this user following" lookups and the feed join
+    __table_args__ = (
+        db.Index('ix_follows_following_followed', 'user_following_id', 'user_being_followed_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -38,7 +45,14 @@ class Follow(db.Model):
 class Like(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
+    __tablename__ = 'likes'
+
+    # a user may like a message only once, but many users may like the
+    # same message; the reverse index serves "who liked this message"
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id', name='uq_likes_user_message'),
+        db.Index('ix_likes_message_user', 'message_id', 'user_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -52,8 +66,7 @@ class Like(db.Model):
 
     message_id = db.Column(
         db.Integer,
-        db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        db.ForeignKey('messages.id', ondelete='cascade')
     )
 
     def __repr__(self):
@@ -65,6 +78,17 @@ class User(db.Model):
 
     __tablename__ = 'users'
 
+    # trigram index so substring searches (ILIKE '%q%') in list_users can use
+    # an index scan instead of a sequential scan (requires the pg_trgm extension)
+    __table_args__ = (
+        db.Index(
+            'ix_users_username_trgm',
+            'username',
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'},
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -105,7 +129,12 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', cascade='all, delete-orphan')
+    messages = db.relationship(
+        'Message',
+        back_populates='user',
+        order_by='desc(Message.timestamp)',
+        cascade='all, delete-orphan',
+    )
 
     followers = db.relationship(
         "User",
@@ -131,58 +160,85 @@ class User(db.Model):
 
     def is_followed_by(self, other_user_id):
         """Is this user followed by `other_user`?"""
-        is_followed_by = Follow.query.filter_by(user_being_followed_id=self.id, user_following_id=other_user_id).first() 
-        
-        return bool(is_followed_by)
 
-        # found_user_list = [user for user in self.followers if user == other_user]
-        # return len(found_user_list) == 1
+        # EXISTS stops at the first matching index tuple instead of
+        # materializing a row
+        return db.session.query(
+            db.exists().where(db.and_(
+                Follow.user_being_followed_id == self.id,
+                Follow.user_following_id == other_user_id,
+            ))
+        ).scalar()
 
     def is_following(self, other_user_id):
         """Is this user following `other_use`?"""
 
-        is_following = Follow.query.filter_by(user_being_followed_id=other_user_id, user_following_id=self.id).first()
-
-        return bool(is_following)
-        
-        # found_user_list = [user for user in self.following if user == other_user]
-        # return len(found_user_list) == 1
+        return db.session.query(
+            db.exists().where(db.and_(
+                Follow.user_being_followed_id == other_user_id,
+                Follow.user_following_id == self.id,
+            ))
+        ).scalar()
 
     def get_all_msgs(self, limit=100):
         '''
-        Get messages from the user and the users that the user is following. 
+        Get messages from the user and the users that the user is following.
         Returns at most 'limit' messages ordered by most recent first.
         '''
 
-        msgs_from_following = Message.query.join(Follow, Message.user_id == Follow.user_being_followed_id).filter(Follow.user_following_id == self.id)
-        own_msgs = Message.query.filter_by(user_id = self.id)
-
-        return msgs_from_following.union_all(own_msgs).order_by(Message.timestamp.desc()).limit(limit).all()
+        # single query instead of a UNION ALL so the planner can walk the
+        # (user_id, timestamp DESC) index backward and stop after 'limit' rows
+        followed = db.session.query(Follow.user_being_followed_id).filter_by(user_following_id=self.id).subquery()
+
+        # eager-load the author and likes each message needs for rendering,
+        # instead of one lazy SELECT per message (N+1); raiseload turns any
+        # undeclared lazy load in the template into a hard error
+        return (Message.query
+                .options(db.joinedload(Message.user), db.selectinload(Message.likes),
+                         db.raiseload('*'))
+                .filter(db.or_(Message.user_id == self.id, Message.user_id.in_(followed)))
+                .order_by(Message.timestamp.desc())
+                .limit(limit)
+                .all())
 
     def get_liked_msgs(self, limit=100):
         '''
         Get all messages this user has liked. Returns at most 'limit' messages ordered by most recent first.
         '''
 
-        liked_msgs = Message.query.join(Like, Like.message_id == Message.id).filter(Like.user_id == self.id).order_by(Message.timestamp.desc()).limit(limit).all()
+        liked_msgs = (Message.query
+                      .options(db.joinedload(Message.user), db.selectinload(Message.likes),
+                               db.raiseload('*'))
+                      .join(Like, Like.message_id == Message.id)
+                      .filter(Like.user_id == self.id)
+                      .order_by(Message.timestamp.desc())
+                      .limit(limit)
+                      .all())
         return liked_msgs
 
 
     def toggle_msg_like(self, msg):
         '''If message is not in users's list of liked messages, add it. Otherwise, remove
-        from liked messages. '''
+        from liked messages. Returns True if the message is liked after the toggle,
+        False otherwise.'''
 
         try:
 
+            liked = self.is_liked_msg(msg.id)
+
             # don't allow user to like/unlike own messages
             if msg.user_id != self.id:
 
                 # if message is already liked, remove it from likes, else add it to likes
-                self.likes.remove(msg) if self.is_liked_msg(msg.id) else self.likes.append(msg)
+                self.likes.remove(msg) if liked else self.likes.append(msg)
 
                 db.session.add(self)
                 db.session.commit()
 
+                liked = not liked
+
+            return liked
+
         except Exception as e:
             logging.exception(e)
             raise e
@@ -202,6 +258,18 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
+        # indexed pre-check so the common "already taken" case returns
+        # without paying for bcrypt plus a failed INSERT and rollback
+        existing = (db.session.query(User.username, User.email)
+                    .filter(db.or_(User.username == username, User.email == email))
+                    .first())
+
+        if existing:
+            if existing.username == username:
+                raise UsernameAlreadyExistsError(username=username)
+            else:
+                raise EmailAlreadyExistsError(email=email)
+
         hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
 
         user = User(
@@ -219,6 +287,8 @@ class User(db.Model):
             return user
 
         except Exception as e:
+            # fallback for the race where another signup commits between
+            # the pre-check and this INSERT
             logging.exception(e)
             if 'users_username_key' in str(e):
                 raise UsernameAlreadyExistsError(username=user.username)
@@ -257,6 +327,11 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # composite index so per-user timeline queries are an ordered index scan
+    __table_args__ = (
+        db.Index('ix_messages_user_ts', 'user_id', db.text('timestamp DESC')),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -279,7 +354,7 @@ class Message(db.Model):
         nullable=False,
     )
 
-    user = db.relationship('User')
+    user = db.relationship('User', back_populates='messages')
 
     likes = db.relationship('Like')
 
@@ -287,6 +362,15 @@ class Message(db.Model):
         return f"<Message id={self.id}, user_id={self.user_id}>"
 
 
+# the trigram index on users.username needs the pg_trgm extension;
+# create it before the tables when bootstrapping a Postgres database
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -295,4 +379,7 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    # pick up app config (e.g. BCRYPT_LOG_ROUNDS); without init_app the
+    # module-level Bcrypt always hashes at its built-in default cost
+    bcrypt.init_app(app)
 
@@ -0,0 +1,19 @@
+// Toggle message likes over fetch() instead of a full-page form post,
+// so liking a message doesn't re-render the whole homepage.
+
+document.addEventListener('submit', async (evt) => {
+  const form = evt.target;
+  if (!form.matches('#messages-form')) return;
+
+  evt.preventDefault();
+
+  const resp = await fetch(form.action, {
+    method: 'POST',
+    headers: { 'Accept': 'application/json' },
+  });
+  if (!resp.ok) return;
+
+  const { liked } = await resp.json();
+  const icon = form.querySelector('i');
+  icon.className = liked ? 'bi bi-hand-thumbs-up-fill' : 'bi bi-hand-thumbs-up';
+});
@@ -3,13 +3,13 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follow, Like
+from models import db, User, Message
 from test_user_model import create_test_user
 from sqlalchemy.exc import IntegrityError, DataError
 from datetime import datetime
-from copy import deepcopy
 
-os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+# setdefault so conftest.py can point xdist workers at their own DBs
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-test')
 
 from app import app
 
@@ -26,12 +26,19 @@ class MessageModelTestCase(TestCase):
     '''Test the message model.'''
 
     def setUp(self):
-        """Create test client, add sample data."""  
-
-        for model in [User, Message, Follow, Like]:
-            model.query.delete()
-
-        self.client = app.test_client()
+        """Add sample data."""
+
+        # one O(1) TRUNCATE instead of four per-row DELETEs; RESTART
+        # IDENTITY keeps id-based assertions stable between tests
+        # (TRUNCATE is Postgres-only, so fall back to DELETEs on the
+        # WARBLER_FAST_TESTS SQLite database)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(
+                db.text('TRUNCATE users, messages, follows, likes RESTART IDENTITY CASCADE'))
+        else:
+            for table in reversed(db.metadata.sorted_tables):
+                db.session.execute(table.delete())
+        db.session.commit()
 
         self.msg_creator = create_test_user()
 
@@ -74,12 +81,10 @@ class MessageModelTestCase(TestCase):
         create_test_message(self.msg_data)
 
         # create msg data with no text 
-        no_text_data = deepcopy(self.msg_data)
-        no_text_data['text'] = None
+        no_text_data = {**self.msg_data, 'text': None}
 
         # create msg data with no user_id 
-        no_user_id_data = deepcopy(self.msg_data)
-        no_user_id_data['user_id'] = None
+        no_user_id_data = {**self.msg_data, 'user_id': None}
 
         for missing_data in [no_text_data, no_user_id_data]:
             self.assertRaises(IntegrityError, create_test_message, missing_data)
@@ -5,20 +5,11 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
+# conftest picks the test database (and engine options) before the app
+# is imported, both under pytest and in standalone unittest runs
+from conftest import ViewsTestCase
 
-from models import db, connect_db, Message, User
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
+from models import db, bcrypt, Message, User
 
 from app import app, CURR_USER_KEY
 
@@ -34,31 +25,39 @@ app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 # disable CSRF checking
 app.config['WTF_CSRF_ENABLED'] = False
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-db.drop_all()
-db.create_all()
-
+# keep fixture hashing cheap (~1ms vs ~100ms per hash) no matter which
+# database URL the suite ended up pointed at
+bcrypt._log_rounds = 4
 
-class MessageViewTestCase(TestCase):
-    """Test views for messages."""
+# one bcrypt hash shared by every fixture user: hash once per module,
+# not once per created user
+TEST_PWD_HASH = bcrypt.generate_password_hash('testuser').decode('UTF-8')
 
-    def setUp(self):
-        """Create test client, add sample data."""
 
-        User.query.delete()
-        Message.query.delete()
+class MessageViewTestCase(ViewsTestCase):
+    """Test views for messages.
 
-        self.client = app.test_client()
+    Sample data is created once per class inside the outer transaction
+    managed by ViewsTestCase (conftest.py); each test runs in a
+    SAVEPOINT that tearDown rolls back, so no per-test DELETEs ever
+    reach the database.
+    """
 
-        self.testuser = User.signup(username="testuser",
-                                    email="test@test.com",
-                                    password="testuser",
-                                    image_url=None)
+    @classmethod
+    def create_class_fixtures(cls):
+        """Insert the sample user directly with the precomputed hash; the
+        signup code path has its own tests."""
 
+        db.session.execute(User.__table__.insert(), [{
+            'username': 'testuser',
+            'email': 'test@test.com',
+            'password': TEST_PWD_HASH,
+            'image_url': None,
+        }])
         db.session.commit()
 
+        cls.testuser = User.query.filter_by(username='testuser').one()
+
     def test_add_message(self):
         """Can user add a message?"""
 
@@ -6,10 +6,9 @@
 
 
 import os
-from copy import deepcopy
 from unittest import TestCase
 
-from models import db, User, Message, Follow, Like
+from models import db, User, Message
 from custom_exceptions import UsernameAlreadyExistsError, EmailAlreadyExistsError
 from sqlalchemy.exc import IntegrityError
 
@@ -18,7 +17,8 @@ from sqlalchemy.exc import IntegrityError
 # before we import our app, since that will have already
 # connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# setdefault so conftest.py can point xdist workers at their own DBs
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
 
 
 # Now we can import app
@@ -68,12 +68,19 @@ class UserModelTestCase(TestCase):
     """Test the User model."""
 
     def setUp(self):
-        """Create test client, add sample data."""
-
-        for model in [User, Message, Follow, Like]:
-            model.query.delete()
-
-        self.client = app.test_client()
+        """Add sample data."""
+
+        # one O(1) TRUNCATE instead of four per-row DELETEs; RESTART
+        # IDENTITY keeps id-based assertions stable between tests
+        # (TRUNCATE is Postgres-only, so fall back to DELETEs on the
+        # WARBLER_FAST_TESTS SQLite database)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(
+                db.text('TRUNCATE users, messages, follows, likes RESTART IDENTITY CASCADE'))
+        else:
+            for table in reversed(db.metadata.sorted_tables):
+                db.session.execute(table.delete())
+        db.session.commit()
 
     def tearDown(self):
         '''Clean up fouled transactions.'''
@@ -128,12 +135,10 @@ class UserModelTestCase(TestCase):
         User.signup(**USER_DATA)
 
         # create user data with same username 
-        same_username_data = deepcopy(USER_DATA2)
-        same_username_data['username'] = USER_DATA['username']
+        same_username_data = {**USER_DATA2, 'username': USER_DATA['username']}
 
         # create user data with same email 
-        same_email_data = deepcopy(USER_DATA2)
-        same_email_data['email'] = USER_DATA['email']
+        same_email_data = {**USER_DATA2, 'email': USER_DATA['email']}
 
         self.assertRaises(EmailAlreadyExistsError, User.signup, **same_email_data)
         db.session.rollback()
@@ -143,16 +148,13 @@ class UserModelTestCase(TestCase):
         '''Test that signup() fails when username, email, or password are not provided.'''
 
         # create user data with no username 
-        no_username_data = deepcopy(USER_DATA)
-        no_username_data['username'] = None
+        no_username_data = {**USER_DATA, 'username': None}
 
         # create user data with no email 
-        no_email_data = deepcopy(USER_DATA)
-        no_email_data['email'] = None
+        no_email_data = {**USER_DATA, 'email': None}
 
         # create user data with no password 
-        no_pass_data = deepcopy(USER_DATA)
-        no_pass_data['password'] = None
+        no_pass_data = {**USER_DATA, 'password': None}
 
         for missing_data in [no_username_data, no_email_data]:
             self.assertRaises(IntegrityError, User.signup, **missing_data)
@@ -191,8 +193,7 @@ class UserModelTestCase(TestCase):
         create_test_user(USER_DATA)
 
         # create second user with identical username
-        copied_data = deepcopy(USER_DATA)
-        copied_data['email'] = 'different@test.com'
+        copied_data = {**USER_DATA, 'email': 'different@test.com'}
       
         self.assertRaises(IntegrityError, create_test_user, copied_data)
 
@@ -203,8 +204,7 @@ class UserModelTestCase(TestCase):
         create_test_user(USER_DATA)
 
         # create second user with identical email
-        copied_data = deepcopy(USER_DATA)
-        copied_data['username'] = 'different'
+        copied_data = {**USER_DATA, 'username': 'different'}
       
         self.assertRaises(IntegrityError, create_test_user, copied_data)
         